@@ -13,5 +13,30 @@ class Settings(BaseSettings):
     API_BASE_URL: str = "https://openapi.opinion.trade/openapi"
     POLLING_INTERVAL: int = 60  # seconds
     PRICE_SPIKE_THRESHOLD: float = 5.0  # percentage
+    MARKET_TAGS: str = ""  # comma-separated upstream tags to follow, e.g. "Crypto,Macro"; empty = all markets
+    # Rolling price statistics (windows like 5m, 1h, 24h)
+    STATS_WINDOWS: str = "5m,15m,1h,24h"  # horizons tracked and reported in alerts
+    SPIKE_ALERT_WINDOWS: str = "1h"  # windows whose change is compared with PRICE_SPIKE_THRESHOLD
+    SPIKE_ZSCORE_WINDOW: str = "24h"
+    SPIKE_ZSCORE_THRESHOLD: float = 0.0  # alert when |z-score| on SPIKE_ZSCORE_WINDOW reaches this; 0 disables
+
+    # Traffic capture: "live", "record" (live + write capture) or "replay" (serve capture, no network)
+    API_MODE: str = "live"
+    CAPTURE_PATH: str = "capture.jsonl.gz"
+    REPLAY_SPEED: float = 1.0  # virtual clock multiplier in replay mode
+
+    # In-memory caches for price and market-detail lookups
+    PRICE_CACHE_TTL: float = 5.0  # seconds
+    MARKET_CACHE_TTL: float = 60.0  # seconds
+    CACHE_MAX_ENTRIES: int = 2048
+
+    # Warm-start snapshot of the monitor state; empty SNAPSHOT_PATH disables it
+    SNAPSHOT_PATH: str = "opinion_state.bin"
+    SNAPSHOT_INTERVAL: int = 300  # seconds between snapshots
+    SNAPSHOT_MAX_AGE: int = 1800  # ignore snapshots older than this on boot (seconds)
+
+    @property
+    def market_tags(self) -> list[str]:
+        return [t.strip() for t in self.MARKET_TAGS.split(",") if t.strip()]
 
 config = Settings()
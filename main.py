@@ -1,8 +1,11 @@
 
 import asyncio
 import logging
+import os
 import sys
-from datetime import datetime, timedelta
+import time
+from datetime import timedelta
+from typing import Optional
 from aiogram import Bot, Dispatcher, types
 from aiogram.enums import ParseMode
 from aiogram.client.default import DefaultBotProperties
@@ -13,6 +16,8 @@ from handlers.commands import router as commands_router
 from services.opinion_api import OpinionAPIService
 from services.db_service import DBService
 from services.category_service import CategoryService
+from services.state_service import MonitorState
+from services.rolling_stats import RollingStatsEngine, build_stats_engine
 
 # Setup logging
 logging.basicConfig(
@@ -28,6 +33,11 @@ async def broadcast_message(bot: Bot, subscribers: list, text: str, url: str):
     builder.row(types.InlineKeyboardButton(text="Trade Now 🚀", url=url))
     markup = builder.as_markup()
 
+    if config.API_MODE == "replay":
+        # Replayed alerts go to the log so runs can be diffed without messaging real users
+        logger.info(f"[replay] alert -> {url}\n{text}")
+        return
+
     if config.CHANNEL_ID:
         try:
             await bot.send_message(chat_id=config.CHANNEL_ID, text=text, reply_markup=markup, parse_mode=ParseMode.HTML)
@@ -40,13 +50,19 @@ async def broadcast_message(bot: Bot, subscribers: list, text: str, url: str):
         except Exception as e:
             logger.error(f"Failed to send to {chat_id}: {e}")
 
-async def check_prices_for_spikes(spike_targets: list, bot: Bot, api_service: OpinionAPIService, db_service: DBService):
+async def check_prices_for_spikes(spike_targets: list, bot: Bot, api_service: OpinionAPIService, db_service: DBService,
+                                  price_stats: RollingStatsEngine, state: Optional[MonitorState] = None):
     """Background task to check prices without blocking discovery of new markets."""
+    state = state or MonitorState()
     subscribers = await db_service.get_subscribers()
-    if not subscribers and not config.CHANNEL_ID:
+    if not subscribers and not config.CHANNEL_ID and not api_service.is_replay:
         return
 
+    sweep_started = time.monotonic()
+    price_stats.retain(target["id"] for target in spike_targets)
     for target in spike_targets:
+        if api_service.replay_finished:
+            break
         try:
             target_id = target["id"]
             yes_token_id = target["yesTokenId"]
@@ -56,63 +72,165 @@ async def check_prices_for_spikes(spike_targets: list, bot: Bot, api_service: Op
                 
             current_price = await api_service.get_token_price(yes_token_id, market_id=target.get("market_id") or target["id"])
             if current_price is not None:
-                # Get price from 1 hour ago
-                old_price = await db_service.get_old_price(target_id, hours=1)
-                if old_price and old_price > 0:
-                    change_1h = ((current_price - old_price) / old_price) * 100
-                    
-                    if abs(change_1h) >= config.PRICE_SPIKE_THRESHOLD:
+                now_ts = api_service.clock.time()
+                if not price_stats.has_market(target_id):
+                    # First sight of this market: seed its windows from stored history once
+                    since = api_service.clock.now() - timedelta(seconds=price_stats.max_window + 3600)
+                    price_stats.seed(target_id, await db_service.get_price_history(target_id, since))
+                window_stats = price_stats.observe(target_id, now_ts, current_price)
+
+                # Windows whose change crossed the threshold, then the volatility z-score check
+                triggered = [
+                    name for name in price_stats.alert_windows
+                    if window_stats[name]["change_pct"] is not None
+                    and abs(window_stats[name]["change_pct"]) >= config.PRICE_SPIKE_THRESHOLD
+                ]
+                zscore = window_stats[price_stats.zscore_window]["zscore"] if price_stats.zscore_window else None
+                zscore_hit = zscore is not None and abs(zscore) >= config.SPIKE_ZSCORE_THRESHOLD
+
+                if triggered or zscore_hit:
+
+                    if target_id in state.last_notified:
+                        last_notif = state.last_notified[target_id]
+                    else:
                         last_notif = await db_service.get_last_notified_data(target_id)
+                        state.last_notified[target_id] = last_notif
+                    
+                    should_send = False
+                    if last_notif is None:
+                        should_send = True
+                    else:
+                        last_price = last_notif["price"]
+                        last_time = last_notif["sent_at"]
+                        change_since_last = ((current_price - last_price) / last_price) * 100
                         
-                        should_send = False
-                        if last_notif is None:
+                        if abs(change_since_last) >= config.PRICE_SPIKE_THRESHOLD:
+                            should_send = True
+                        elif api_service.clock.now() - last_time > timedelta(hours=6):
                             should_send = True
+
+                    if should_send:
+                        logger.info(f"Spike alert for {target['title']}!")
+                        display_title = target["title"]
+                        category_tag = CategoryService.get_category_hashtag(display_title, target.get("tags"))
+                        if triggered:
+                            headline_change = window_stats[triggered[0]]["change_pct"]
+                            direction = "🟩 +" if headline_change > 0 else "🟥 "
+                            headline = f"{direction}{headline_change:.2f}% ({triggered[0].upper()})"
                         else:
-                            last_price = last_notif["price"]
-                            last_time = last_notif["sent_at"]
-                            change_since_last = ((current_price - last_price) / last_price) * 100
-                            
-                            if abs(change_since_last) >= config.PRICE_SPIKE_THRESHOLD:
-                                should_send = True
-                            elif datetime.now() - last_time > timedelta(hours=6):
-                                should_send = True
-
-                        if should_send:
-                            logger.info(f"Spike alert for {target['title']}!")
-                            direction = "🟩 +" if change_1h > 0 else "🟥 "
-                            display_title = target["title"]
-                            category_tag = CategoryService.get_category_hashtag(display_title)
-                            
-                            spike_message = (
-                                f"⚡️ <b>Significant Change Detected!</b>\n\n"
-                                f"{direction}{change_1h:.2f}% (1H) - <b>{display_title}</b>\n\n"
-                                f"📊 Current Probability: {current_price*100:.1f}%\n"
-                                f"💰 Volume 24h: ${target['volume24h']:,.0f}\n\n"
-                                f"💡 {category_tag}"
-                            )
-                            trade_url = api_service.get_trade_url(target["trade_id"], is_multi=target["is_multi"])
-                            await broadcast_message(bot, subscribers, spike_message, trade_url)
-                            await db_service.record_spike_notification(target_id, yes_token_id, current_price)
+                            # Fired on volatility alone: lead with the z-score that crossed the threshold
+                            headline = f"{'🟩' if zscore > 0 else '🟥'} {zscore:+.1f}σ ({price_stats.zscore_window.upper()})"
+                        horizons = " | ".join(
+                            f"{name.upper()} {stats['change_pct']:+.2f}%"
+                            for name, stats in window_stats.items() if stats["change_pct"] is not None
+                        )
+                        horizons_line = f"📈 {horizons}\n" if horizons else ""
+                        
+                        spike_message = (
+                            f"⚡️ <b>Significant Change Detected!</b>\n\n"
+                            f"{headline} - <b>{display_title}</b>\n\n"
+                            f"📊 Current Probability: {current_price*100:.1f}%\n"
+                            f"{horizons_line}"
+                            f"💰 Volume 24h: ${target['volume24h']:,.0f}\n\n"
+                            f"💡 {category_tag}"
+                        )
+                        trade_url = api_service.get_trade_url(target["trade_id"], is_multi=target["is_multi"])
+                        await broadcast_message(bot, subscribers, spike_message, trade_url)
+                        await db_service.record_spike_notification(target_id, yes_token_id, current_price)
+                        state.record_notification(target_id, current_price, api_service.clock.now())
                 
                 await db_service.save_price(target_id, yes_token_id, current_price)
             
             # Small delay between individual requests to maintain low RPS
-            await asyncio.sleep(0.3)
+            await api_service.clock.sleep(0.3)
         except Exception as e:
             logger.error(f"Error in background price check for {target.get('title')}: {e}")
 
-async def monitor_markets(bot: Bot, api_service: OpinionAPIService, db_service: DBService):
+    logger.info(f"Price sweep of {len(spike_targets)} targets finished in {time.monotonic() - sweep_started:.2f}s")
+    for stats in api_service.cache_stats():
+        logger.info(f"Cache {stats['name']}: size={stats['size']} hits={stats['hits']} "
+                    f"misses={stats['misses']} coalesced={stats['coalesced']} hit_rate={stats['hit_rate']:.0%}")
+
+def build_spike_targets(markets: list) -> list:
+    """Flatten unresolved markets (and the children of multi-markets) into price-check targets."""
+    spike_targets = []
+    for market in markets:
+        if market.get("resolvedAt") != 0: continue
+        children = market.get("childMarkets") or []
+        market_id = str(market.get("marketId"))
+        market_tags = CategoryService.get_market_tags(market)
+
+        if not children:
+            spike_targets.append({
+                "id": market_id, "title": market.get("marketTitle"),
+                "yesTokenId": market.get("yesTokenId"),
+                "volume24h": float(market.get("volume24h") or 0),
+                "trade_id": market_id, "is_multi": False,
+                "tags": market_tags
+            })
+        else:
+            parent_title = market.get("marketTitle")
+            for child in children:
+                if child.get("resolvedAt") == 0:
+                    spike_targets.append({
+                        "id": str(child.get("marketId")),
+                        "title": f"{parent_title} - {child.get('marketTitle')}",
+                        "yesTokenId": child.get("yesTokenId"),
+                        "volume24h": float(child.get("volume24h") or child.get("volume") or 0),
+                        "trade_id": market_id, "market_id": str(child.get("marketId")),
+                        "is_multi": True, "tags": market_tags
+                    })
+    return spike_targets
+
+def save_snapshot(state: MonitorState, api_service: OpinionAPIService):
+    """Persist the monitor state for the next warm start (disabled in replay or without SNAPSHOT_PATH)."""
+    if not config.SNAPSHOT_PATH or api_service.is_replay:
+        return
+    try:
+        state.save(config.SNAPSHOT_PATH, api_service.clock.time())
+    except Exception as e:
+        logger.error(f"Failed to save state snapshot: {e}")
+
+async def monitor_markets(bot: Bot, api_service: OpinionAPIService, db_service: DBService,
+                          price_stats: RollingStatsEngine, state: Optional[MonitorState] = None):
     """Background task to monitor new markets and trigger background price checks."""
     logger.info("Starting market monitoring...")
+    state = state or MonitorState()
     price_task = None
+    last_snapshot = api_service.clock.time()
+
+    # Warm start: sweep prices for the restored markets right away and only crawl new pages on the first pass
+    warm_start = state.is_warm
+    if warm_start:
+        price_task = asyncio.create_task(
+            check_prices_for_spikes(build_spike_targets(state.markets), bot, api_service, db_service, price_stats, state))
     
     while True:
+        if api_service.replay_finished:
+            if price_task is not None and not price_task.done():
+                await price_task
+            logger.info("Replay reached the end of the capture, stopping market monitoring.")
+            return
+
         try:
             # 1. DISCOVERY (Fast Priority)
-            markets = await api_service.get_markets()
+            cycle_started = time.monotonic()
+            if warm_start:
+                markets = await api_service.get_markets(since=state.discovery_high_water)
+                fetched_ids = {m.get("marketId") for m in markets}
+                markets += [m for m in state.markets if m.get("marketId") not in fetched_ids]
+                warm_start = False
+            else:
+                markets = await api_service.get_markets()
+            if not markets and api_service.is_replay:
+                logger.info("Replay has no more recorded discovery pages, stopping market monitoring.")
+                return
+            if markets:
+                state.update_discovery(markets)
             subscribers = await db_service.get_subscribers()
+            logger.info(f"Discovery fetched {len(markets)} markets in {time.monotonic() - cycle_started:.2f}s")
             
-            if subscribers or config.CHANNEL_ID:
+            if subscribers or config.CHANNEL_ID or api_service.is_replay:
                 child_ids_to_skip = set()
                 for market in markets:
                     children = market.get("childMarkets") or []
@@ -122,7 +240,7 @@ async def monitor_markets(bot: Bot, api_service: OpinionAPIService, db_service:
                 for market in markets:
                     market_id = str(market.get("marketId"))
                     created_at = market.get("createdAt", 0)
-                    now_ts = datetime.now().timestamp()
+                    now_ts = api_service.clock.time()
                     
                     if not await db_service.is_market_processed(market_id) and market_id not in child_ids_to_skip:
                         title = market.get("marketTitle", "Unknown Market")
@@ -137,7 +255,7 @@ async def monitor_markets(bot: Bot, api_service: OpinionAPIService, db_service:
                         children = market.get("childMarkets") or []
                         is_multi = market.get("marketType") == 1 or len(children) > 0
                         trade_url = api_service.get_trade_url(market_id, is_multi=is_multi)
-                        category_tag = CategoryService.get_category_hashtag(title)
+                        category_tag = CategoryService.get_category_hashtag(title, CategoryService.get_market_tags(market))
                         
                         if children:
                             options_list = "\n".join([f"• {c.get('marketTitle')}" for c in children])
@@ -173,42 +291,25 @@ async def monitor_markets(bot: Bot, api_service: OpinionAPIService, db_service:
                         await broadcast_message(bot, subscribers, message_text, trade_url)
 
                 # 2. TRIGGER BACKGROUND PRICE MONITORING
-                spike_targets = []
-                for market in markets:
-                    if market.get("resolvedAt") != 0: continue
-                    children = market.get("childMarkets") or []
-                    market_id = str(market.get("marketId"))
-                    
-                    if not children:
-                        spike_targets.append({
-                            "id": market_id, "title": market.get("marketTitle"),
-                            "yesTokenId": market.get("yesTokenId"),
-                            "volume24h": float(market.get("volume24h") or 0),
-                            "trade_id": market_id, "is_multi": False
-                        })
-                    else:
-                        parent_title = market.get("marketTitle")
-                        for child in children:
-                            if child.get("resolvedAt") == 0:
-                                spike_targets.append({
-                                    "id": str(child.get("marketId")),
-                                    "title": f"{parent_title} - {child.get('marketTitle')}",
-                                    "yesTokenId": child.get("yesTokenId"),
-                                    "volume24h": float(child.get("volume24h") or child.get("volume") or 0),
-                                    "trade_id": market_id, "market_id": str(child.get("marketId")),
-                                    "is_multi": True
-                                })
+                spike_targets = build_spike_targets(markets)
 
+                if api_service.is_replay:
+                    # Sweep inline so every replay issues requests in the same order
+                    await check_prices_for_spikes(spike_targets, bot, api_service, db_service, price_stats, state)
                 # Start price check task if no previous task is running
-                if price_task is None or price_task.done():
-                    price_task = asyncio.create_task(check_prices_for_spikes(spike_targets, bot, api_service, db_service))
+                elif price_task is None or price_task.done():
+                    price_task = asyncio.create_task(check_prices_for_spikes(spike_targets, bot, api_service, db_service, price_stats, state))
                 else:
                     logger.info("Price monitoring still in progress, skipping spike update for this cycle.")
 
         except Exception as e:
             logger.exception(f"Error in discovery loop: {e}")
+
+        if api_service.clock.time() - last_snapshot >= config.SNAPSHOT_INTERVAL:
+            save_snapshot(state, api_service)
+            last_snapshot = api_service.clock.time()
             
-        await asyncio.sleep(config.POLLING_INTERVAL)
+        await api_service.clock.sleep(config.POLLING_INTERVAL)
 
 async def main():
     # Initialize bot and dispatcher
@@ -221,17 +322,44 @@ async def main():
     # Register routers
     dp.include_router(commands_router)
 
+    # Spike window settings are validated here, before anything starts
+    price_stats = build_stats_engine(config.STATS_WINDOWS, config.SPIKE_ALERT_WINDOWS,
+                                     config.SPIKE_ZSCORE_WINDOW, config.SPIKE_ZSCORE_THRESHOLD)
+
     # Initialize services
     api_service = OpinionAPIService()
-    db_service = DBService()
+    db_path = config.DB_PATH
+    if api_service.is_replay:
+        # Never touch the live database from a replay, and start every replay from a clean slate
+        db_path = f"{config.CAPTURE_PATH}.replay.db"
+        if os.path.exists(db_path):
+            os.remove(db_path)
+        logger.info(f"Replay uses scratch database {db_path}")
+    db_service = DBService(db_path=db_path, clock=api_service.clock)
     await db_service.init_db()
 
-    # Start notification task
-    asyncio.create_task(monitor_markets(bot, api_service, db_service))
+    # Restore the last snapshot so monitoring resumes without a cold crawl
+    state = None
+    if config.SNAPSHOT_PATH and not api_service.is_replay:
+        state = MonitorState.load(config.SNAPSHOT_PATH, now=api_service.clock.time(), max_age=config.SNAPSHOT_MAX_AGE)
+    state = state or MonitorState()
+
+    try:
+        if api_service.is_replay:
+            # Replay runs the monitor alone against the capture; no Telegram polling
+            logger.info(f"Replaying {config.CAPTURE_PATH} at {config.REPLAY_SPEED}x...")
+            await monitor_markets(bot, api_service, db_service, price_stats, state)
+            return
+
+        # Start notification task
+        asyncio.create_task(monitor_markets(bot, api_service, db_service, price_stats, state))
 
-    # Start polling
-    logger.info("Bot is starting...")
-    await dp.start_polling(bot)
+        # Start polling
+        logger.info("Bot is starting...")
+        await dp.start_polling(bot)
+    finally:
+        save_snapshot(state, api_service)
+        api_service.close()
 
 if __name__ == "__main__":
     try:
@@ -0,0 +1,161 @@
+import asyncio
+import bisect
+import gzip
+import json
+import logging
+import time
+import zlib
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class Clock:
+    """Wall clock used by the monitor in live and record modes."""
+
+    def time(self) -> float:
+        return time.time()
+
+    def now(self) -> datetime:
+        return datetime.fromtimestamp(self.time())
+
+    async def sleep(self, seconds: float):
+        await asyncio.sleep(seconds)
+
+
+class VirtualClock(Clock):
+    """Replay clock that never reads real time, so a capture replays the same way on any machine.
+
+    Time moves forward only when a recorded response is served (to its recorded timestamp) or a
+    task sleeps. `speed` only paces the real wait behind each sleep.
+    """
+
+    def __init__(self, start_ts: float, speed: float = 1.0):
+        self._now = start_ts
+        self.speed = speed if speed > 0 else 1.0
+
+    def time(self) -> float:
+        return self._now
+
+    def advance_to(self, ts: float):
+        self._now = max(self._now, ts)
+
+    async def sleep(self, seconds: float):
+        self._now += seconds
+        await asyncio.sleep(seconds / self.speed)
+
+
+def make_request_key(url: str, params: Optional[Dict[str, Any]] = None) -> str:
+    """Build a stable key for a request so recorded responses can be matched on replay."""
+    if not params:
+        return url
+    query = "&".join(f"{k}={params[k]}" for k in sorted(params))
+    return f"{url}?{query}"
+
+
+class CaptureRecorder:
+    """Append every API response to a gzip-compressed JSONL capture.
+
+    Each flush appends a complete gzip member, so a crash only loses the unflushed tail and
+    later sessions can keep appending to the same file.
+    """
+
+    FLUSH_EVERY = 100
+    FLUSH_INTERVAL = 30.0  # seconds
+
+    def __init__(self, path: str):
+        self.path = path
+        self._pending: List[str] = []
+        self._last_flush = time.monotonic()
+        logger.info(f"Recording Opinion API traffic to {path}")
+
+    def record(self, url: str, params: Optional[Dict[str, Any]], status: int, body: Any, ts: float):
+        """Write a single response record stamped with the time its request was sent."""
+        entry = {
+            "ts": ts,
+            "key": make_request_key(url, params),
+            "status": status,
+            "body": body,
+        }
+        self._pending.append(json.dumps(entry, separators=(",", ":")) + "\n")
+        if len(self._pending) >= self.FLUSH_EVERY or time.monotonic() - self._last_flush >= self.FLUSH_INTERVAL:
+            self.flush()
+
+    def flush(self):
+        """Write buffered records as one self-contained gzip member."""
+        self._last_flush = time.monotonic()
+        if not self._pending:
+            return
+        with open(self.path, "ab") as fh:
+            fh.write(gzip.compress("".join(self._pending).encode("utf-8")))
+        self._pending = []
+
+    def close(self):
+        self.flush()
+
+
+class CaptureReplayer:
+    """Serve each request's recorded responses in recorded order on a virtual clock."""
+
+    def __init__(self, path: str, speed: float = 1.0):
+        self.path = path
+        self._index: Dict[str, Tuple[List[float], List[Tuple[int, Any]]]] = {}
+        self._cursors: Dict[str, int] = {}
+        first_ts = None
+        self.end_ts = 0.0
+        count = 0
+        try:
+            with gzip.open(path, "rt", encoding="utf-8") as fh:
+                for line in fh:
+                    if not line.strip():
+                        continue
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        logger.warning(f"Skipping malformed line in capture {path}")
+                        continue
+                    timestamps, responses = self._index.setdefault(entry["key"], ([], []))
+                    timestamps.append(entry["ts"])
+                    responses.append((entry["status"], entry["body"]))
+                    if first_ts is None or entry["ts"] < first_ts:
+                        first_ts = entry["ts"]
+                    self.end_ts = max(self.end_ts, entry["ts"])
+                    count += 1
+        except (EOFError, zlib.error, gzip.BadGzipFile) as e:
+            # A recorder that died mid-write leaves a truncated last member; keep what was read
+            logger.warning(f"Capture {path} is truncated ({e}); replaying the {count} responses read so far")
+
+        # Captures are appended in order, but multi-session files may interleave; keep lookups sorted.
+        for key, (timestamps, responses) in self._index.items():
+            if any(a > b for a, b in zip(timestamps, timestamps[1:])):
+                ordered = sorted(zip(timestamps, responses), key=lambda item: item[0])
+                self._index[key] = ([ts for ts, _ in ordered], [r for _, r in ordered])
+
+        self.clock = VirtualClock(first_ts or time.time(), speed)
+        logger.info(f"Loaded {count} recorded responses from {path}, replaying at {self.clock.speed}x")
+
+    @property
+    def finished(self) -> bool:
+        """True once the virtual clock has passed the last recorded response."""
+        return self.clock.time() > self.end_ts
+
+    def lookup(self, url: str, params: Optional[Dict[str, Any]] = None) -> Optional[Tuple[int, Any]]:
+        """Return the next recorded (status, body) for a request, or None once the key is exhausted.
+
+        Responses are served in recorded order and the clock jumps to each one's timestamp. If the
+        replay has already moved past some recordings (e.g. the live run polled a key more often),
+        those are skipped so the replay never goes back in time.
+        """
+        key = make_request_key(url, params)
+        entry = self._index.get(key)
+        if entry is None:
+            return None
+        timestamps, responses = entry
+        latest_due = bisect.bisect_right(timestamps, self.clock.time()) - 1
+        pos = max(self._cursors.get(key, 0), latest_due)
+        if pos >= len(responses):
+            return None
+        self._cursors[key] = pos + 1
+        self.clock.advance_to(timestamps[pos])
+        return responses[pos]
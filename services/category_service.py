@@ -1,8 +1,24 @@
 import re
+from typing import Any, Dict, List, Optional
 
 class CategoryService:
     @staticmethod
-    def get_category_hashtag(title: str) -> str:
+    def get_market_tags(market: Dict[str, Any]) -> List[str]:
+        """Tags the API gave us for a market: the tag filter it was fetched under, else its own `tags` field."""
+        tags = market.get("_tags") or market.get("tags") or []
+        if isinstance(tags, str):
+            tags = tags.split(",")
+        names = [(t.get("name") or t.get("tagName") or "") if isinstance(t, dict) else t for t in tags]
+        return [str(n).strip() for n in names if str(n).strip()]
+
+    @staticmethod
+    def get_category_hashtag(title: str, tags: Optional[List[str]] = None) -> str:
+        # Upstream tags are authoritative; keywords are only a fallback
+        if tags:
+            hashtag = re.sub(r"[^0-9A-Za-z]", "", tags[0])
+            if hashtag:
+                return f"#{hashtag}"
+
         title_lower = title.lower()
         
         # Mapping from Website categories to keywords
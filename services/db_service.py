@@ -4,12 +4,18 @@ import logging
 from typing import Optional
 from core.config import config
 from datetime import datetime, timedelta
+from services.capture_service import Clock
 
 logger = logging.getLogger(__name__)
 
 class DBService:
-    def __init__(self, db_path: str = config.DB_PATH):
+    def __init__(self, db_path: str = config.DB_PATH, clock: Optional[Clock] = None):
         self.db_path = db_path
+        # Timestamps come from the clock (not CURRENT_TIMESTAMP) so replayed captures keep their own timeline
+        self.clock = clock or Clock()
+
+    def _now_str(self) -> str:
+        return self.clock.now().strftime('%Y-%m-%d %H:%M:%S')
 
     async def init_db(self):
         """Create tables if they don't exist."""
@@ -78,15 +84,15 @@ class DBService:
         """Save current price to history."""
         async with aiosqlite.connect(self.db_path) as db:
             await db.execute(
-                "INSERT INTO price_history (market_id, token_id, price) VALUES (?, ?, ?)",
-                (market_id, token_id, price)
+                "INSERT INTO price_history (market_id, token_id, price, timestamp) VALUES (?, ?, ?, ?)",
+                (market_id, token_id, price, self._now_str())
             )
             await db.commit()
 
     async def get_old_price(self, market_id: str, hours: int = 1) -> Optional[float]:
         """Get the price closest to X hours ago."""
         async with aiosqlite.connect(self.db_path) as db:
-            target_time = datetime.now() - timedelta(hours=hours)
+            target_time = self.clock.now() - timedelta(hours=hours)
             query = """
                 SELECT price FROM price_history 
                 WHERE market_id = ? AND timestamp <= ? 
@@ -96,10 +102,22 @@ class DBService:
                 row = await cursor.fetchone()
                 return row[0] if row else None
 
+    async def get_price_history(self, market_id: str, since: datetime) -> list[tuple[float, float]]:
+        """Get (unix ts, price) samples recorded since a given time, oldest first."""
+        async with aiosqlite.connect(self.db_path) as db:
+            query = """
+                SELECT timestamp, price FROM price_history 
+                WHERE market_id = ? AND timestamp >= ? 
+                ORDER BY timestamp ASC
+            """
+            async with db.execute(query, (market_id, since.strftime('%Y-%m-%d %H:%M:%S'))) as cursor:
+                rows = await cursor.fetchall()
+                return [(datetime.strptime(row[0], '%Y-%m-%d %H:%M:%S').timestamp(), row[1]) for row in rows]
+
     async def should_notify_spike(self, market_id: str, hours: int = 2) -> bool:
         """Check if we already sent a spike notification for this market in the last X hours."""
         async with aiosqlite.connect(self.db_path) as db:
-            limit_time = datetime.now() - timedelta(hours=hours)
+            limit_time = self.clock.now() - timedelta(hours=hours)
             query = "SELECT 1 FROM spike_notifications WHERE market_id = ? AND sent_at > ? LIMIT 1"
             async with db.execute(query, (market_id, limit_time.strftime('%Y-%m-%d %H:%M:%S'))) as cursor:
                 return await cursor.fetchone() is None
@@ -108,8 +126,8 @@ class DBService:
         """Record that a spike notification was sent."""
         async with aiosqlite.connect(self.db_path) as db:
             await db.execute(
-                "INSERT INTO spike_notifications (market_id, token_id, last_price) VALUES (?, ?, ?)",
-                (market_id, token_id, price)
+                "INSERT INTO spike_notifications (market_id, token_id, last_price, sent_at) VALUES (?, ?, ?, ?)",
+                (market_id, token_id, price, self._now_str())
             )
             await db.commit()
 
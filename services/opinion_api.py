@@ -2,30 +2,135 @@
 import asyncio
 import httpx
 import logging
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Iterable, Optional, Tuple
 from core.config import config
+from services.capture_service import Clock, CaptureRecorder, CaptureReplayer
+from services.cache_service import AsyncTTLCache
 
 logger = logging.getLogger(__name__)
 
 class OpinionAPIService:
-    def __init__(self, api_key: str = config.API_KEY, base_url: str = config.API_BASE_URL):
+    def __init__(self,
+                 api_key: str = config.API_KEY,
+                 base_url: str = config.API_BASE_URL,
+                 mode: str = config.API_MODE,
+                 capture_path: str = config.CAPTURE_PATH,
+                 replay_speed: float = config.REPLAY_SPEED):
         self.base_url = base_url
         self.headers = {
             "apikey": api_key,
             "Content-Type": "application/json"
         }
+        # "live" talks to the API, "record" also writes every response to a capture,
+        # "replay" serves a capture back on a virtual clock without touching the network.
+        self.mode = mode
+        self.recorder: Optional[CaptureRecorder] = None
+        self.replayer: Optional[CaptureReplayer] = None
+        self.clock: Clock = Clock()
+        if mode == "record":
+            self.recorder = CaptureRecorder(capture_path)
+        elif mode == "replay":
+            self.replayer = CaptureReplayer(capture_path, speed=replay_speed)
+            self.clock = self.replayer.clock
+        elif mode != "live":
+            raise ValueError(f"Unknown API_MODE: {mode}")
+
+        # Concurrent lookups of the same token/market share one upstream call. The spike sweep alone
+        # looks each YES token up once per sweep, so hits only come from callers that overlap it.
+        self.price_cache = AsyncTTLCache("price", maxsize=config.CACHE_MAX_ENTRIES,
+                                         ttl=config.PRICE_CACHE_TTL, clock=self.clock)
+        self.market_cache = AsyncTTLCache("market", maxsize=config.CACHE_MAX_ENTRIES,
+                                          ttl=config.MARKET_CACHE_TTL, clock=self.clock)
+
+    @property
+    def is_replay(self) -> bool:
+        return self.replayer is not None
+
+    @property
+    def replay_finished(self) -> bool:
+        return self.replayer is not None and self.replayer.finished
+
+    def cache_stats(self) -> List[Dict[str, Any]]:
+        return [self.price_cache.stats(), self.market_cache.stats()]
+
+    def close(self):
+        """Flush and close the capture file when recording."""
+        if self.recorder:
+            self.recorder.close()
+
+    async def _request(self,
+                       url: str,
+                       params: Optional[Dict[str, Any]] = None,
+                       headers: Optional[Dict[str, str]] = None,
+                       timeout: float = 20.0) -> Tuple[int, Any]:
+        """GET a JSON endpoint and return (status_code, body), going through the capture when enabled."""
+        if self.replayer:
+            recorded = self.replayer.lookup(url, params)
+            if recorded is None:
+                raise LookupError(f"No recorded response for {url} {params or ''}")
+            return recorded
+
+        started = self.clock.time()
+        async with httpx.AsyncClient(timeout=timeout) as client:
+            response = await client.get(url, headers=headers, params=params)
+        try:
+            body = response.json()
+        except ValueError:
+            body = None
+        if self.recorder:
+            self.recorder.record(url, params, response.status_code, body, ts=started)
+        return response.status_code, body
 
     async def get_markets(self, 
                           page: int = 1, 
                           page_size: int = 50, 
                           status: str = "activated", 
-                          sort_order: int = 1) -> List[Dict[str, Any]]:
-        """Fetch markets from Opinion API (Binary type 0, Multi type 1, and Other type 2)."""
+                          sort_order: int = 1,
+                          tags: Optional[Iterable[str]] = None,
+                          since: Optional[float] = None) -> List[Dict[str, Any]]:
+        """Fetch markets from Opinion API (Binary type 0, Multi type 1, and Other type 2).
+
+        When `tags` (default: `MARKET_TAGS` from config) is non-empty, only those upstream tags are
+        fetched, one concurrent crawl per tag, and each market records the tags it was found under.
+        With `since` (a createdAt high-water mark) paging stops once a page holds only older markets,
+        so the result is partial and must be merged with a previously known list.
+        """
+        tags = [t for t in (config.market_tags if tags is None else tags) if t]
+        if tags:
+            per_tag = await asyncio.gather(*[self._fetch_markets(status, sort_order, tag=t, since=since) for t in tags])
+            all_markets = []
+            for tag, m_list in zip(tags, per_tag):
+                all_markets.extend({**m, "_tags": [tag]} for m in m_list)
+        else:
+            all_markets = await self._fetch_markets(status, sort_order, since=since)
+        
+        # Deduplicate markets by ID
+        unique_by_id = {}
+        for m in all_markets:
+            mid = m.get("marketId")
+            if not mid:
+                continue
+            if mid not in unique_by_id:
+                unique_by_id[mid] = m
+            elif m.get("_tags"):
+                # Same market listed under several tags: keep every tag it matched
+                known = unique_by_id[mid].setdefault("_tags", [])
+                known.extend(t for t in m["_tags"] if t not in known)
+        
+        return list(unique_by_id.values())
+
+    async def _fetch_markets(self,
+                             status: str,
+                             sort_order: int,
+                             tag: Optional[str] = None,
+                             since: Optional[float] = None) -> List[Dict[str, Any]]:
+        """Crawl every market type page by page, optionally filtered server-side by a single tag."""
         all_markets = []
         # Types represent different categories of markets in Opinion.trade
         # Type 1 (Multi), 0 (Single), 2 (Other), 3 (Trending/New)
         # We fetch multiple pages because the API seems to cap at 10 items per request.
         # Increased to 10 pages (100 items per type) to ensure no events are missed under heavy load.
+        label = f"tag {tag} " if tag else ""
         for mt in [1, 0, 2, 3]:
             for p in range(1, 11): 
                 url = f"{self.base_url}/market"
@@ -36,80 +141,116 @@ class OpinionAPIService:
                     "marketType": mt,
                     "sort": sort_order
                 }
+                if tag:
+                    params["tags"] = tag
                 
-                async with httpx.AsyncClient(timeout=20.0) as client:
-                    try:
-                        response = await client.get(url, headers=self.headers, params=params)
-                        response.raise_for_status()
-                        data = response.json()
-                        
-                        if data.get("errno") == 0:
-                            result = data.get("result", {})
-                            if isinstance(result, dict):
-                                m_list = result.get("list", [])
-                                if not m_list:
-                                    break # No more markets for this type
-                                all_markets.extend(m_list)
-                                if len(m_list) < 10:
-                                    break # Last page
-                        else:
-                            logger.error(f"API Error for type {mt} page {p}: {data}")
-                            break
-                    except Exception as e:
-                        logger.error(f"Request failed for type {mt} page {p}: {e}")
+                try:
+                    http_status, data = await self._request(url, params=params, headers=self.headers, timeout=20.0)
+                    if http_status >= 400:
+                        raise RuntimeError(f"HTTP {http_status}")
+                    
+                    if data.get("errno") == 0:
+                        result = data.get("result", {})
+                        if isinstance(result, dict):
+                            m_list = result.get("list", [])
+                            if not m_list:
+                                break # No more markets for this type
+                            all_markets.extend(m_list)
+                            if len(m_list) < 10:
+                                break # Last page
+                            if since and self._is_older_page(mt, m_list, since):
+                                break # Everything from here on was already discovered
+                    else:
+                        logger.error(f"API Error for {label}type {mt} page {p}: {data}")
                         break
+                except Exception as e:
+                    logger.error(f"Request failed for {label}type {mt} page {p}: {e}")
+                    break
                 # Tiny delay to avoid overwhelming the API
-                await asyncio.sleep(0.1)
-        
-        # Deduplicate markets by ID
-        seen_ids = set()
-        unique_markets = []
-        for m in all_markets:
-            mid = m.get("marketId")
-            if mid and mid not in seen_ids:
-                unique_markets.append(m)
-                seen_ids.add(mid)
-        
-        return unique_markets
+                await self.clock.sleep(0.1)
+        return all_markets
+
+    # Market types whose listing we expect in creation order; Trending (3) is ranked by activity
+    # and is always crawled in full.
+    _CREATION_ORDERED_TYPES = (0, 1, 2)
+
+    def _is_older_page(self, market_type: int, m_list: List[Dict[str, Any]], since: float) -> bool:
+        """True if a page proves the rest of this type's listing predates the high-water mark.
 
+        Creation order is not documented by the API, so it is checked on the page itself:
+        the page must be newest-first by createdAt and hold nothing newer than `since`.
+        """
+        if market_type not in self._CREATION_ORDERED_TYPES:
+            return False
+        created = [float(m.get("createdAt") or 0) for m in m_list]
+        newest_first = all(a >= b for a, b in zip(created, created[1:]))
+        return newest_first and max(created) <= since
 
+    async def get_market_detail(self, market_id: str) -> Optional[Dict[str, Any]]:
+        """Fetch a single market's detail object (cached)."""
+        return await self.market_cache.get_or_load(
+            ("detail", str(market_id)), lambda: self._fetch_market_detail(market_id))
+
+    async def _fetch_market_detail(self, market_id: str) -> Optional[Dict[str, Any]]:
+        url = f"{self.base_url}/market/{market_id}"
+        try:
+            status, data = await self._request(url, headers=self.headers, timeout=15.0)
+            if status >= 400:
+                raise RuntimeError(f"HTTP {status}")
+            if data.get("errno") == 0:
+                return data.get("result", {}).get("data")
+            logger.error(f"API Error for market {market_id}: {data}")
+        except Exception as e:
+            logger.error(f"Failed to fetch market detail for {market_id}: {e}")
+        return None
 
     async def get_token_price(self, token_id: str, market_id: Optional[str] = None) -> Optional[float]:
+        """Fetch the latest price for a token (cached for PRICE_CACHE_TTL seconds)."""
+        return await self.price_cache.get_or_load(
+            ("price", str(token_id), market_id), lambda: self._fetch_token_price(token_id, market_id))
+
+    async def _get_topic(self, market_id: str) -> Optional[Dict[str, Any]]:
+        """Fetch Topic proxy data for a market (cached per market, so any token of it can reuse the call)."""
+        return await self.price_cache.get_or_load(("topic", str(market_id)), lambda: self._fetch_topic(market_id))
+
+    async def _fetch_topic(self, market_id: str) -> Optional[Dict[str, Any]]:
+        # The Proxy API often has fresher price data for new types like 'Hourly'
+        proxy_url = f"https://proxy.opinion.trade:8443/api/bsc/api/v2/topic/{market_id}"
+        try:
+            status, data = await self._request(proxy_url, timeout=15.0)
+            if status == 200:
+                return data.get("result", {}).get("data", {})
+        except Exception as e:
+            logger.error(f"Fallback Topic API failed for market {market_id}: {e}")
+        return None
+
+    async def _fetch_token_price(self, token_id: str, market_id: Optional[str] = None) -> Optional[float]:
         """Fetch the latest price for a token with fallback to Topic API for Hourly markets."""
         # Try Open API first
         url = f"{self.base_url}/token/latest-price"
         params = {"token_id": token_id}
-        async with httpx.AsyncClient(timeout=15.0) as client:
-            try:
-                response = await client.get(url, headers=self.headers, params=params)
-                response.raise_for_status()
-                data = response.json()
-                if data.get("errno") == 0:
-                    result = data.get("result", {})
-                    price_str = result.get("price")
-                    if price_str and float(price_str) > 0:
-                        return float(price_str)
-            except Exception as e:
-                logger.error(f"Failed to fetch price from Open API for {token_id}: {e}")
+        try:
+            status, data = await self._request(url, params=params, headers=self.headers, timeout=15.0)
+            if status >= 400:
+                raise RuntimeError(f"HTTP {status}")
+            if data.get("errno") == 0:
+                result = data.get("result", {})
+                price_str = result.get("price")
+                if price_str and float(price_str) > 0:
+                    return float(price_str)
+        except Exception as e:
+            logger.error(f"Failed to fetch price from Open API for {token_id}: {e}")
 
         # Fallback to Topic API (Proxy) if market_id is provided and price was 0 or failed
         if market_id:
-            try:
-                # The Proxy API often has fresher price data for new types like 'Hourly'
-                proxy_url = f"https://proxy.opinion.trade:8443/api/bsc/api/v2/topic/{market_id}"
-                async with httpx.AsyncClient(timeout=15.0) as client:
-                    response = await client.get(proxy_url)
-                    if response.status_code == 200:
-                        data = response.json()
-                        res = data.get("result", {}).get("data", {})
-                        # logger.info(f"DEBUG Topic Proxy: yesPos={res.get('yesPos')} vs token_id={token_id}")
-                        # Check if token matches yesPos or noPos
-                        if str(res.get("yesPos")) == str(token_id):
-                            return float(res.get("yesMarketPrice") or 0)
-                        elif str(res.get("noPos")) == str(token_id):
-                            return float(res.get("noMarketPrice") or 0)
-            except Exception as e:
-                logger.error(f"Fallback Topic API failed for market {market_id}: {e}")
+            res = await self._get_topic(market_id)
+            if res:
+                # logger.info(f"DEBUG Topic Proxy: yesPos={res.get('yesPos')} vs token_id={token_id}")
+                # Check if token matches yesPos or noPos
+                if str(res.get("yesPos")) == str(token_id):
+                    return float(res.get("yesMarketPrice") or 0)
+                elif str(res.get("noPos")) == str(token_id):
+                    return float(res.get("noMarketPrice") or 0)
         
         return None
 
@@ -0,0 +1,192 @@
+import math
+import re
+from collections import deque
+from typing import Dict, Iterable, List, Optional, Tuple
+
+_UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+
+
+def parse_window(spec: str) -> int:
+    """Convert a window like "15m" or "24h" to seconds."""
+    match = re.fullmatch(r"\s*(\d+)\s*([smhd])\s*", spec.lower())
+    if not match:
+        raise ValueError(f"Invalid window: {spec!r} (expected e.g. 5m, 1h, 24h)")
+    return int(match.group(1)) * _UNITS[match.group(2)]
+
+
+def parse_window_list(specs: str) -> List[str]:
+    """Split a comma-separated window list, validating each entry."""
+    names = [s.strip().lower() for s in specs.split(",") if s.strip()]
+    for name in names:
+        parse_window(name)
+    return names
+
+
+class RollingWindow:
+    """Time-based window over price samples with O(1) amortized updates.
+
+    Keeps running sums for mean/variance and monotonic deques for min/max. The last sample that
+    fell out of the window is kept as `reference`, i.e. the price as of `length` seconds ago.
+    """
+
+    def __init__(self, length: int):
+        self.length = length
+        self._samples: deque = deque()
+        self._min: deque = deque()
+        self._max: deque = deque()
+        self._sum = 0.0
+        self._sumsq = 0.0
+        self.reference: Optional[Tuple[float, float]] = None
+
+    def add(self, ts: float, price: float):
+        sample = (ts, price)
+        self._samples.append(sample)
+        self._sum += price
+        self._sumsq += price * price
+        while self._min and self._min[-1][1] >= price:
+            self._min.pop()
+        self._min.append(sample)
+        while self._max and self._max[-1][1] <= price:
+            self._max.pop()
+        self._max.append(sample)
+        self.evict(ts)
+
+    def evict(self, now: float):
+        """Drop samples older than the window, remembering the newest dropped one as the reference."""
+        cutoff = now - self.length
+        while self._samples and self._samples[0][0] <= cutoff:
+            sample = self._samples.popleft()
+            self._sum -= sample[1]
+            self._sumsq -= sample[1] * sample[1]
+            if self._min and self._min[0] is sample:
+                self._min.popleft()
+            if self._max and self._max[0] is sample:
+                self._max.popleft()
+            self.reference = sample
+        if not self._samples:
+            self._sum = self._sumsq = 0.0
+
+    @property
+    def count(self) -> int:
+        return len(self._samples)
+
+    @property
+    def first(self) -> Optional[float]:
+        return self._samples[0][1] if self._samples else None
+
+    @property
+    def low(self) -> Optional[float]:
+        return self._min[0][1] if self._min else None
+
+    @property
+    def high(self) -> Optional[float]:
+        return self._max[0][1] if self._max else None
+
+    @property
+    def mean(self) -> Optional[float]:
+        return self._sum / len(self._samples) if self._samples else None
+
+    @property
+    def stddev(self) -> Optional[float]:
+        n = len(self._samples)
+        if n < 2:
+            return None
+        # Population variance; clamp float cancellation noise
+        variance = max(self._sumsq / n - (self._sum / n) ** 2, 0.0)
+        return math.sqrt(variance)
+
+    def change_pct(self, price: float) -> Optional[float]:
+        """Percentage change from the price `length` seconds ago, or None until the window is covered."""
+        if self.reference is None or self.reference[1] <= 0:
+            return None
+        return (price - self.reference[1]) / self.reference[1] * 100
+
+    def zscore(self, price: float, min_samples: int = 10) -> Optional[float]:
+        std = self.stddev
+        if self.count < min_samples or not std:
+            return None
+        return (price - self.mean) / std
+
+
+class RollingStatsEngine:
+    """Per-market rolling statistics for several windows, updated once per price sample.
+
+    `alert_windows` and `zscore_window` name the tracked windows the spike check alerts on.
+    """
+
+    def __init__(self, windows: Iterable[str], alert_windows: Iterable[str] = (), zscore_window: Optional[str] = None):
+        self.windows: Dict[str, int] = {name: parse_window(name) for name in windows}
+        if not self.windows:
+            raise ValueError("At least one window is required")
+        self.alert_windows = list(alert_windows)
+        self.zscore_window = zscore_window
+        untracked = [w for w in self.alert_windows + [zscore_window] if w and w not in self.windows]
+        if untracked:
+            raise ValueError(f"Alert windows are not tracked: {untracked}")
+        self._markets: Dict[str, Dict[str, RollingWindow]] = {}
+
+    @property
+    def max_window(self) -> int:
+        return max(self.windows.values())
+
+    def has_market(self, market_id: str) -> bool:
+        return market_id in self._markets
+
+    def _windows_for(self, market_id: str) -> Dict[str, RollingWindow]:
+        windows = self._markets.get(market_id)
+        if windows is None:
+            windows = {name: RollingWindow(length) for name, length in self.windows.items()}
+            self._markets[market_id] = windows
+        return windows
+
+    def seed(self, market_id: str, samples: Iterable[Tuple[float, float]]):
+        """Load historical (ts, price) samples, oldest first, without producing stats."""
+        windows = self._windows_for(market_id)
+        for ts, price in samples:
+            for window in windows.values():
+                window.add(ts, price)
+
+    def observe(self, market_id: str, ts: float, price: float) -> Dict[str, dict]:
+        """Add a sample and return per-window stats.
+
+        The z-score is measured against the window as it was before this sample.
+        """
+        windows = self._windows_for(market_id)
+        stats = {}
+        for name, window in windows.items():
+            window.evict(ts)
+            zscore = window.zscore(price)
+            window.add(ts, price)
+            stats[name] = {
+                "change_pct": window.change_pct(price),
+                "zscore": zscore,
+                "min": window.low,
+                "max": window.high,
+                "first": window.first,
+                "mean": window.mean,
+                "stddev": window.stddev,
+                "count": window.count,
+            }
+        return stats
+
+    def retain(self, market_ids: Iterable[str]):
+        """Drop state for markets that are no longer monitored."""
+        keep = set(market_ids)
+        for market_id in [m for m in self._markets if m not in keep]:
+            del self._markets[market_id]
+
+
+def build_stats_engine(stats_windows: str,
+                       alert_windows: str,
+                       zscore_window: str,
+                       zscore_threshold: float) -> RollingStatsEngine:
+    """Validate the spike window settings and build the engine; raises ValueError on bad config."""
+    alerts = parse_window_list(alert_windows)
+    zscore = None
+    if zscore_threshold > 0:
+        zscore_windows = parse_window_list(zscore_window)
+        if len(zscore_windows) != 1:
+            raise ValueError(f"SPIKE_ZSCORE_WINDOW must be a single window, got {zscore_window!r}")
+        zscore = zscore_windows[0]
+    windows = parse_window_list(stats_windows) + alerts + ([zscore] if zscore else [])
+    return RollingStatsEngine(dict.fromkeys(windows), alert_windows=alerts, zscore_window=zscore)
@@ -0,0 +1,91 @@
+import json
+import logging
+import os
+import struct
+import zlib
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_MAGIC = b"OPST"
+SNAPSHOT_VERSION = 2
+_HEADER = struct.Struct(">4sHd")  # magic, version, saved_at
+
+
+class MonitorState:
+    """Working state of the market monitor that is snapshotted to disk for warm restarts."""
+
+    def __init__(self):
+        self.markets: List[Dict[str, Any]] = []
+        # market_id -> {"price", "sent_at"} as returned by DBService.get_last_notified_data (None = never notified)
+        self.last_notified: Dict[str, Optional[dict]] = {}
+        # Newest market createdAt seen by discovery; pages older than this can be skipped after a restart
+        self.discovery_high_water: float = 0.0
+        self.saved_at: float = 0.0
+
+    @property
+    def is_warm(self) -> bool:
+        return bool(self.markets)
+
+    def update_discovery(self, markets: List[Dict[str, Any]]):
+        self.markets = markets
+        newest = max((float(m.get("createdAt") or 0) for m in markets), default=0.0)
+        self.discovery_high_water = max(self.discovery_high_water, newest)
+
+    def record_notification(self, market_id: str, price: float, sent_at: datetime):
+        self.last_notified[market_id] = {"price": price, "sent_at": sent_at}
+
+    def save(self, path: str, now: float):
+        """Write a zlib-compressed JSON snapshot atomically (write to temp file, then rename)."""
+        self.saved_at = now
+        payload = {
+            "markets": self.markets,
+            "last_notified": {
+                market_id: None if notif is None else {"price": notif["price"], "sent_at": notif["sent_at"].isoformat()}
+                for market_id, notif in self.last_notified.items()
+            },
+            "discovery_high_water": self.discovery_high_water,
+        }
+        body = zlib.compress(json.dumps(payload, separators=(",", ":")).encode("utf-8"), 6)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as fh:
+            fh.write(_HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, now))
+            fh.write(body)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str, now: float, max_age: float) -> Optional["MonitorState"]:
+        """Restore a snapshot, or return None if it is missing, unreadable, from the future or older than `max_age`."""
+        if not path or not os.path.exists(path):
+            return None
+        try:
+            with open(path, "rb") as fh:
+                magic, version, saved_at = _HEADER.unpack(fh.read(_HEADER.size))
+                if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION:
+                    logger.warning(f"Ignoring state snapshot {path}: unknown format")
+                    return None
+                age = now - saved_at
+                if age < 0:
+                    logger.warning(f"Ignoring state snapshot {path}: saved {-age:.0f}s in the future")
+                    return None
+                if age > max_age:
+                    logger.info(f"Ignoring state snapshot {path}: {age:.0f}s old (max {max_age:.0f}s)")
+                    return None
+                payload = json.loads(zlib.decompress(fh.read()).decode("utf-8"))
+
+            state = cls()
+            state.markets = payload["markets"]
+            state.last_notified = {
+                market_id: None if notif is None else {"price": notif["price"], "sent_at": datetime.fromisoformat(notif["sent_at"])}
+                for market_id, notif in payload["last_notified"].items()
+            }
+            state.discovery_high_water = payload["discovery_high_water"]
+            state.saved_at = saved_at
+        except Exception as e:
+            logger.error(f"Failed to load state snapshot {path}: {e}")
+            return None
+
+        logger.info(f"Restored state snapshot from {age:.0f}s ago: {len(state.markets)} markets, "
+                    f"{len(state.last_notified)} notification records")
+        return state
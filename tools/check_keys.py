@@ -2,6 +2,7 @@ import asyncio
 import httpx
 import os
 from dotenv import load_dotenv
+from services.opinion_api import OpinionAPIService
 
 load_dotenv()
 
@@ -19,10 +20,14 @@ async def check_keys():
             print(f"Keys in market object: {list(market.keys())}")
             # Also fetch detail for the same market
             m_id = market['marketId']
-            r_detail = await client.get(f"https://openapi.opinion.trade/openapi/market/{m_id}", headers=headers)
-            detail = r_detail.json()
-            if detail['errno'] == 0:
-                print(f"Keys in detail object: {list(detail['result']['data'].keys())}")
+            # Always probe the live API, whatever API_MODE .env selects for the bot
+            api_service = OpinionAPIService(api_key=api_key, mode="live")
+            try:
+                detail = await api_service.get_market_detail(m_id)
+            finally:
+                api_service.close()
+            if detail:
+                print(f"Keys in detail object: {list(detail.keys())}")
         else:
             print("No markets found.")
 